@@ -0,0 +1,20 @@
+import numpy as np
+
+# Numba is optional: when installed, the amount difference is computed by a fused,
+# multi-threaded kernel; otherwise the NumPy fallback below is used.
+try:
+    import numba
+except ImportError:
+    numba = None
+
+if numba is not None:
+    @numba.njit(parallel=True, fastmath=True, cache=True)
+    def amount_diff(expected_amount, onchain_amount, out):
+        """Writes abs(expected_amount - onchain_amount) into out."""
+        for i in numba.prange(expected_amount.shape[0]):
+            out[i] = abs(expected_amount[i] - onchain_amount[i])
+else:
+    def amount_diff(expected_amount, onchain_amount, out):
+        """Writes abs(expected_amount - onchain_amount) into out."""
+        np.subtract(expected_amount, onchain_amount, out=out, casting='unsafe')
+        np.abs(out, out=out)
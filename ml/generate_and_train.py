@@ -1,11 +1,13 @@
 import pandas as pd
 import numpy as np
 import joblib
+from joblib import parallel_backend
 import os
-import uuid
+from concurrent.futures import ThreadPoolExecutor
 from sklearn.ensemble import IsolationForest
 from sklearn.preprocessing import StandardScaler
 from sklearn.metrics import accuracy_score, precision_score, recall_score, f1_score, roc_auc_score, confusion_matrix
+from ml.features import amount_diff
 
 # --- Configuration ---
 N_NORMAL = 1000
@@ -13,86 +15,108 @@ N_ANOMALOUS = 200
 N_VALIDATION = 200
 MODEL_DIR = "ml"
 SEED = 42
+BATCH_SIZE = 4096 # Records generated per batch
+
+# Column layout of the generated record arrays
+EXPECTED_AMOUNT, TIME_TO_SETTLEMENT, GAS_USED, VALUE_DATE_DELAY = range(4)
 
 MODEL_PATH = os.path.join(MODEL_DIR, "anomaly_detector.joblib")
 SCALER_PATH = os.path.join(MODEL_DIR, "scaler.joblib")
 
-np.random.seed(SEED)
-
 # --- Data Generation Logic (from generate_data.py) ---
 
-def generate_base_data(n_samples):
-    data = {
-        'instruction_id': [str(uuid.uuid4()) for _ in range(n_samples)],
-        'expected_amount': np.random.uniform(1000, 100000, n_samples).round(2),
-        'time_to_settlement': np.random.normal(loc=60, scale=20, size=n_samples).clip(5),
-        'gas_used': np.random.normal(loc=50000, scale=10000, size=n_samples).clip(21000),
-        'value_date_delay': np.random.poisson(lam=0.2, size=n_samples)
-    }
-    return pd.DataFrame(data)
-
-def generate_anomalies(base_df):
-    anomalous_df = base_df.copy()
-    n = len(anomalous_df)
+def generate_base_data(n_samples, rng):
+    records = np.empty((n_samples, 4), dtype=np.float32)
+    records[:, EXPECTED_AMOUNT] = rng.uniform(1000, 100000, n_samples).round(2)
+    records[:, TIME_TO_SETTLEMENT] = rng.normal(loc=60, scale=20, size=n_samples).clip(5)
+    records[:, GAS_USED] = rng.normal(loc=50000, scale=10000, size=n_samples).clip(21000)
+    records[:, VALUE_DATE_DELAY] = rng.poisson(lam=0.2, size=n_samples)
+    return records
+
+def generate_anomalies(records, onchain_amount, rng):
+    # Modifies records and onchain_amount in place
+    n = len(records)
     indices = np.arange(n)
-    np.random.shuffle(indices)
+    rng.shuffle(indices)
 
     mismatch_indices = indices[:int(n * 0.4)]
-    anomalous_df.loc[mismatch_indices, 'onchain_amount'] *= np.random.uniform(0.5, 1.5, len(mismatch_indices))
+    onchain_amount[mismatch_indices] *= rng.uniform(0.5, 1.5, len(mismatch_indices))
     delay_indices = indices[int(n * 0.4):int(n * 0.7)]
-    anomalous_df.loc[delay_indices, 'time_to_settlement'] *= np.random.uniform(10, 50, len(delay_indices))
+    records[delay_indices, TIME_TO_SETTLEMENT] *= rng.uniform(10, 50, len(delay_indices))
     gas_indices = indices[int(n * 0.7):int(n * 0.9)]
-    anomalous_df.loc[gas_indices, 'gas_used'] *= np.random.uniform(3, 8, len(gas_indices))
+    records[gas_indices, GAS_USED] *= rng.uniform(3, 8, len(gas_indices))
     date_delay_indices = indices[int(n * 0.9):]
-    anomalous_df.loc[date_delay_indices, 'value_date_delay'] += np.random.randint(5, 15, len(date_delay_indices))
-
-    return anomalous_df
+    records[date_delay_indices, VALUE_DATE_DELAY] += rng.integers(5, 15, len(date_delay_indices))
+
+def generate_batch(n_normal, n_anomalous, rng):
+    # Returns shuffled (records, onchain_amount, labels) arrays
+    n_total = n_normal + n_anomalous
+    records = generate_base_data(n_total, rng)
+    onchain_amount = np.empty(n_total, dtype=np.float32)
+    labels = np.zeros(n_total, dtype=np.int8)
+    onchain_amount[:n_normal] = records[:n_normal, EXPECTED_AMOUNT] * rng.normal(1.0, 0.001, n_normal)
+    onchain_amount[n_normal:] = records[n_normal:, EXPECTED_AMOUNT]
+    generate_anomalies(records[n_normal:], onchain_amount[n_normal:], rng)
+    labels[n_normal:] = 1
+    order = rng.permutation(n_total)
+    return records[order], onchain_amount[order], labels[order]
+
+def iter_batches(n_normal, n_anomalous, rng, batch_size=BATCH_SIZE):
+    # Yields shuffled (X_chunk, y_chunk) arrays; normal and anomalous records are
+    # spread across batches in proportion so the whole dataset is never materialized.
+    n_total = n_normal + n_anomalous
+    for start in range(0, n_total, batch_size):
+        stop = min(start + batch_size, n_total)
+        batch_normal = stop * n_normal // n_total - start * n_normal // n_total
+        records, onchain_amount, labels = generate_batch(batch_normal, (stop - start) - batch_normal, rng)
+        yield feature_engineering(records, onchain_amount), labels
+
+def build_dataset(n_normal, n_anomalous, rng):
+    # Fills preallocated feature/label arrays from the batch stream
+    n_total = n_normal + n_anomalous
+    X = np.empty((n_total, 4), dtype=np.float32)
+    y = np.empty(n_total, dtype=np.int8)
+    offset = 0
+    for X_chunk, y_chunk in iter_batches(n_normal, n_anomalous, rng):
+        X[offset:offset + len(X_chunk)] = X_chunk
+        y[offset:offset + len(y_chunk)] = y_chunk
+        offset += len(X_chunk)
+    return X, y
 
 def generate_datasets():
     print("Generating synthetic data...")
-    # Training Data
-    df_normal = generate_base_data(N_NORMAL)
-    df_normal['onchain_amount'] = df_normal['expected_amount'] * np.random.normal(1.0, 0.001, N_NORMAL)
-    df_normal['anomaly_label'] = 0
-    df_anomalous_base = generate_base_data(N_ANOMALOUS)
-    df_anomalous_base['onchain_amount'] = df_anomalous_base['expected_amount']
-    df_anomalous = generate_anomalies(df_anomalous_base)
-    df_anomalous['anomaly_label'] = 1
-    df_train = pd.concat([df_normal, df_anomalous], ignore_index=True).sample(frac=1).reset_index(drop=True)
-
-    # Validation Data
+    # Independent child streams keep the output reproducible from SEED while the
+    # training and validation sets are generated concurrently (NumPy releases the GIL).
+    train_rng, val_rng = np.random.default_rng(SEED).spawn(2)
     n_val_normal = N_VALIDATION - int(N_VALIDATION * (N_ANOMALOUS / (N_NORMAL + N_ANOMALOUS)))
     n_val_anomalous = N_VALIDATION - n_val_normal
-    df_val_normal = generate_base_data(n_val_normal)
-    df_val_normal['onchain_amount'] = df_val_normal['expected_amount'] * np.random.normal(1.0, 0.001, n_val_normal)
-    df_val_normal['anomaly_label'] = 0
-    df_val_anomalous_base = generate_base_data(n_val_anomalous)
-    df_val_anomalous_base['onchain_amount'] = df_val_anomalous_base['expected_amount']
-    df_val_anomalous = generate_anomalies(df_val_anomalous_base)
-    df_val_anomalous['anomaly_label'] = 1
-    df_validation = pd.concat([df_val_normal, df_val_anomalous], ignore_index=True).sample(frac=1).reset_index(drop=True)
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        # Training Data
+        train_future = executor.submit(build_dataset, N_NORMAL, N_ANOMALOUS, train_rng)
+        # Validation Data
+        val_future = executor.submit(build_dataset, n_val_normal, n_val_anomalous, val_rng)
+        X_train, y_train = train_future.result()
+        X_val, y_val = val_future.result()
 
     print("Data generation complete.")
-    return df_train, df_validation
+    return X_train, y_train, X_val, y_val
 
 # --- Model Training Logic (from train_anomaly.py) ---
 
-def feature_engineering(df):
-    df['amount_diff'] = (df['expected_amount'] - df['onchain_amount']).abs()
-    features = ['amount_diff', 'time_to_settlement', 'gas_used', 'value_date_delay']
-    return df[features]
+def feature_engineering(records, onchain_amount):
+    # Features: amount_diff, time_to_settlement, gas_used, value_date_delay
+    features = np.empty_like(records)
+    amount_diff(records[:, EXPECTED_AMOUNT], onchain_amount, features[:, 0])
+    features[:, 1:] = records[:, TIME_TO_SETTLEMENT:]
+    return features
 
 def main():
     """Main function to generate data, train, evaluate, and save the model."""
     print("--- Anomaly Detection Model Generation & Training ---")
 
-    # Generate data in memory
-    df_train, df_val = generate_datasets()
-
-    # Feature Engineering
-    X_train = feature_engineering(df_train)
-    y_val_true = df_val['anomaly_label']
-    X_val = feature_engineering(df_val)
+    # Generate feature matrices in memory
+    X_train, y_train, X_val, y_val_true = generate_datasets()
 
     print(f"Training with {len(X_train)} records...")
 
@@ -102,15 +126,19 @@ def main():
     X_val_scaled = scaler.transform(X_val)
 
     # Model Training
-    contamination = len(df_train[df_train['anomaly_label'] == 1]) / len(df_train)
-    model = IsolationForest(n_estimators=100, contamination=contamination, random_state=SEED)
-    model.fit(X_train_scaled)
+    contamination = float(y_train.mean())
+    model = IsolationForest(n_estimators=100, contamination=contamination, random_state=SEED, n_jobs=-1)
+    # Build trees in threads so workers share X_train_scaled rather than each receiving a copy
+    with parallel_backend("threading", n_jobs=-1):
+        model.fit(X_train_scaled)
 
     print("Model training complete.")
 
     # Evaluation
-    y_pred_raw = model.predict(X_val_scaled)
-    y_pred = np.array([0 if x == 1 else 1 for x in y_pred_raw])
+    # Score trees across all cores; threads share the validation matrix instead of copying it
+    with parallel_backend("threading", n_jobs=-1):
+        y_pred_raw = model.predict(X_val_scaled)
+    y_pred = (y_pred_raw == -1).astype(np.int8)
 
     print("\n--- Model Evaluation on Validation Set ---")
     accuracy = accuracy_score(y_val_true, y_pred)
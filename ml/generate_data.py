@@ -1,7 +1,6 @@
 import pandas as pd
 import numpy as np
 import os
-import uuid
 
 # Configuration
 N_NORMAL = 1000
@@ -9,92 +8,125 @@ N_ANOMALOUS = 200
 N_VALIDATION = 200 # A mix of normal and anomalous for the validation set
 DATA_DIR = "sample_data"
 SEED = 42
-
-np.random.seed(SEED)
-
-def generate_base_data(n_samples):
-    """Generates the base features for a set of transactions."""
-    data = {
-        'instruction_id': [str(uuid.uuid4()) for _ in range(n_samples)],
-        'expected_amount': np.random.uniform(1000, 100000, n_samples).round(2),
-        'time_to_settlement': np.random.normal(loc=60, scale=20, size=n_samples).clip(5), # in seconds
-        'gas_used': np.random.normal(loc=50000, scale=10000, size=n_samples).clip(21000),
-        'value_date_delay': np.random.poisson(lam=0.2, size=n_samples) # in days
-    }
-    return pd.DataFrame(data)
-
-def generate_anomalies(base_df):
-    """Injects anomalies into a dataframe of normal transactions."""
-    anomalous_df = base_df.copy()
-
+BATCH_SIZE = 4096 # Records generated and written per batch
+
+# Column layout of the generated record arrays
+EXPECTED_AMOUNT, TIME_TO_SETTLEMENT, GAS_USED, VALUE_DATE_DELAY = range(4)
+
+def generate_instruction_ids(n_samples):
+    """Generates random UUID4 strings in bulk from a single os.urandom call."""
+    raw = np.frombuffer(bytearray(os.urandom(16 * n_samples)), dtype=np.uint8).reshape(n_samples, 16)
+    raw[:, 6] = (raw[:, 6] & 0x0F) | 0x40 # Version 4
+    raw[:, 8] = (raw[:, 8] & 0x3F) | 0x80 # RFC 4122 variant
+    h = raw.tobytes().hex()
+    return [f"{h[i:i+8]}-{h[i+8:i+12]}-{h[i+12:i+16]}-{h[i+16:i+20]}-{h[i+20:i+32]}" for i in range(0, len(h), 32)]
+
+def generate_base_data(n_samples, rng):
+    """Generates the base features for a set of transactions as an (n_samples, 4) float64 array."""
+    # float64 so expected amounts keep exact cents and the CSV keeps full precision
+    records = np.empty((n_samples, 4), dtype=np.float64)
+    records[:, EXPECTED_AMOUNT] = rng.uniform(1000, 100000, n_samples).round(2)
+    records[:, TIME_TO_SETTLEMENT] = rng.normal(loc=60, scale=20, size=n_samples).clip(5) # in seconds
+    records[:, GAS_USED] = rng.normal(loc=50000, scale=10000, size=n_samples).clip(21000)
+    records[:, VALUE_DATE_DELAY] = rng.poisson(lam=0.2, size=n_samples) # in days
+    return records
+
+def generate_anomalies(records, onchain_amount, rng):
+    """Injects anomalies in place into an array of normal transactions and their on-chain amounts."""
     # Create different types of anomalies
-    n = len(anomalous_df)
+    n = len(records)
     indices = np.arange(n)
-    np.random.shuffle(indices)
+    rng.shuffle(indices)
 
     # Type 1: Amount mismatch (40% of anomalies)
     mismatch_indices = indices[:int(n * 0.4)]
-    anomalous_df.loc[mismatch_indices, 'onchain_amount'] *= np.random.uniform(0.5, 1.5, len(mismatch_indices))
+    onchain_amount[mismatch_indices] *= rng.uniform(0.5, 1.5, len(mismatch_indices))
 
     # Type 2: Delayed settlement (30% of anomalies)
     delay_indices = indices[int(n * 0.4):int(n * 0.7)]
-    anomalous_df.loc[delay_indices, 'time_to_settlement'] *= np.random.uniform(10, 50, len(delay_indices))
+    records[delay_indices, TIME_TO_SETTLEMENT] *= rng.uniform(10, 50, len(delay_indices))
 
     # Type 3: High gas usage (20% of anomalies)
     gas_indices = indices[int(n * 0.7):int(n * 0.9)]
-    anomalous_df.loc[gas_indices, 'gas_used'] *= np.random.uniform(3, 8, len(gas_indices))
+    records[gas_indices, GAS_USED] *= rng.uniform(3, 8, len(gas_indices))
 
     # Type 4: Value date delay (10% of anomalies)
     date_delay_indices = indices[int(n * 0.9):]
-    anomalous_df.loc[date_delay_indices, 'value_date_delay'] += np.random.randint(5, 15, len(date_delay_indices))
-
-    return anomalous_df
+    records[date_delay_indices, VALUE_DATE_DELAY] += rng.integers(5, 15, len(date_delay_indices))
+
+def generate_batch(n_normal, n_anomalous, rng):
+    """
+    Generates a shuffled batch of labelled normal and anomalous transactions.
+    Returns the record array, the on-chain amounts and the anomaly labels.
+    """
+    n_total = n_normal + n_anomalous
+    records = generate_base_data(n_total, rng)
+    onchain_amount = np.empty(n_total, dtype=np.float64)
+    labels = np.zeros(n_total, dtype=np.int8)
 
-def main():
-    """Main function to generate and save datasets."""
-    print("Generating synthetic data for anomaly detection...")
-
-    # --- Generate Training Data ---
     # Normal data
-    df_normal = generate_base_data(N_NORMAL)
-    df_normal['onchain_amount'] = df_normal['expected_amount'] * np.random.normal(1.0, 0.001, N_NORMAL)
-    df_normal['anomaly_label'] = 0
+    onchain_amount[:n_normal] = records[:n_normal, EXPECTED_AMOUNT] * rng.normal(1.0, 0.001, n_normal)
 
     # Anomalous data
-    df_anomalous_base = generate_base_data(N_ANOMALOUS)
     # Start with onchain amount being same as expected before injecting anomalies
-    df_anomalous_base['onchain_amount'] = df_anomalous_base['expected_amount']
-    df_anomalous = generate_anomalies(df_anomalous_base)
-    df_anomalous['anomaly_label'] = 1
+    onchain_amount[n_normal:] = records[n_normal:, EXPECTED_AMOUNT]
+    generate_anomalies(records[n_normal:], onchain_amount[n_normal:], rng)
+    labels[n_normal:] = 1
+
+    order = rng.permutation(n_total)
+    return records[order], onchain_amount[order], labels[order]
+
+def iter_batches(n_normal, n_anomalous, rng, batch_size=BATCH_SIZE):
+    """
+    Yields shuffled batches of at most batch_size transactions.
+    Normal and anomalous records are spread across batches in proportion, so the
+    stream is mixed without the whole dataset ever being held in memory.
+    """
+    n_total = n_normal + n_anomalous
+    for start in range(0, n_total, batch_size):
+        stop = min(start + batch_size, n_total)
+        batch_normal = stop * n_normal // n_total - start * n_normal // n_total
+        yield generate_batch(batch_normal, (stop - start) - batch_normal, rng)
+
+def write_dataset(path, n_normal, n_anomalous, rng):
+    """Streams a generated dataset to a CSV file batch by batch and returns the number of rows written."""
+    n_rows = 0
+    with open(path, 'w', newline='') as f:
+        for records, onchain_amount, labels in iter_batches(n_normal, n_anomalous, rng):
+            # Records only become a DataFrame here, at the file boundary
+            batch = pd.DataFrame({
+                'instruction_id': generate_instruction_ids(len(records)),
+                'expected_amount': records[:, EXPECTED_AMOUNT],
+                'time_to_settlement': records[:, TIME_TO_SETTLEMENT],
+                'gas_used': records[:, GAS_USED],
+                'value_date_delay': records[:, VALUE_DATE_DELAY].astype(np.int64),
+                'onchain_amount': onchain_amount,
+                'anomaly_label': labels
+            })
+            batch.to_csv(f, header=(n_rows == 0), index=False)
+            n_rows += len(batch)
+    return n_rows
 
-    # Combine for training set
-    df_train = pd.concat([df_normal, df_anomalous], ignore_index=True).sample(frac=1).reset_index(drop=True)
-
-    # --- Generate Validation Data ---
-    # A separate set to test the model on unseen data
-    n_val_normal = N_VALIDATION - int(N_VALIDATION * (N_ANOMALOUS / (N_NORMAL + N_ANOMALOUS)))
-    n_val_anomalous = N_VALIDATION - n_val_normal
-
-    df_val_normal = generate_base_data(n_val_normal)
-    df_val_normal['onchain_amount'] = df_val_normal['expected_amount'] * np.random.normal(1.0, 0.001, n_val_normal)
-    df_val_normal['anomaly_label'] = 0
-
-    df_val_anomalous_base = generate_base_data(n_val_anomalous)
-    df_val_anomalous_base['onchain_amount'] = df_val_anomalous_base['expected_amount']
-    df_val_anomalous = generate_anomalies(df_val_anomalous_base)
-    df_val_anomalous['anomaly_label'] = 1
-
-    df_validation = pd.concat([df_val_normal, df_val_anomalous], ignore_index=True).sample(frac=1).reset_index(drop=True)
+def main():
+    """Main function to generate and save datasets."""
+    print("Generating synthetic data for anomaly detection...")
+    # Independent child streams keep each dataset reproducible from SEED on its own,
+    # regardless of the order or number of batches generated for the other.
+    train_rng, val_rng = np.random.default_rng(SEED).spawn(2)
 
-    # Save to CSV
     os.makedirs(DATA_DIR, exist_ok=True)
     train_path = os.path.join(DATA_DIR, "training_data.csv")
     val_path = os.path.join(DATA_DIR, "validation_data.csv")
 
-    df_train.to_csv(train_path, index=False)
-    df_validation.to_csv(val_path, index=False)
+    # A separate validation set to test the model on unseen data
+    n_val_normal = N_VALIDATION - int(N_VALIDATION * (N_ANOMALOUS / (N_NORMAL + N_ANOMALOUS)))
+    n_val_anomalous = N_VALIDATION - n_val_normal
+
+    # Written one after the other: the CSV writing holds the GIL, so threads gave no real speedup
+    n_train = write_dataset(train_path, N_NORMAL, N_ANOMALOUS, train_rng)
+    n_validation = write_dataset(val_path, n_val_normal, n_val_anomalous, val_rng)
 
-    print(f"Successfully generated {len(df_train)} training records and {len(df_validation)} validation records.")
+    print(f"Successfully generated {n_train} training records and {n_validation} validation records.")
     print(f"Training data saved to: {train_path}")
     print(f"Validation data saved to: {val_path}")
 
@@ -1,24 +1,26 @@
 import os
-import json
 import time
+import asyncio
+import queue
 import joblib
-import pandas as pd
+from joblib import parallel_backend
 import numpy as np
 from dotenv import load_dotenv
-from web3 import Web3
+from web3 import AsyncWeb3, WebsocketProviderV2
+from eth_utils import event_abi_to_log_topic
 from flask import Flask, jsonify
 from threading import Thread
 from collections import deque
 
 # --- Local Imports ---
 # Assuming this is run as a module from the root directory
+from offchain.contract import get_contract_abi
 from offchain.database import get_record
 
 # --- Configuration ---
 load_dotenv()
 RPC_URL = os.getenv("RPC_URL", "").replace("http", "ws")
 CONTRACT_ADDRESS = os.getenv("SETTLEMENT_CONTRACT_ADDRESS")
-ABI_PATH = os.path.join("offchain", "build", "MT202Settlement.json")
 MODEL_PATH = os.path.join("ml", "anomaly_detector.joblib")
 SCALER_PATH = os.path.join("ml", "scaler.joblib")
 
@@ -26,43 +28,107 @@ SCALER_PATH = os.path.join("ml", "scaler.joblib")
 # A thread-safe deque to store the last N events
 LAST_N_EVENTS = deque(maxlen=50)
 
+# --- Batched Prediction ---
+# Reconciled records are queued by the listener and scored in batches by a
+# background worker, so the model is invoked once per batch instead of per event.
+PREDICTION_BATCH_SIZE = 64
+PREDICTION_BATCH_TIMEOUT = 0.25 # seconds to wait for a batch to fill up
+PREDICTION_QUEUE = queue.Queue(maxsize=1024)
+
+# The monitor can see an event before the reconciler has written it to the DB,
+# so record lookups are retried with a short exponential backoff.
+RECORD_RETRY_ATTEMPTS = 5
+RECORD_RETRY_DELAY = 0.05 # seconds, doubled after each attempt
+
 # --- Anomaly Detection Logic ---
 
-def predict_anomaly(record):
-    """Predicts if a given reconciliation record is an anomaly."""
+# The model and scaler are loaded lazily on first use and kept for the lifetime
+# of the process, so they are not deserialized from disk on every event.
+_MODEL = None
+_SCALER = None
+
+def _get_model():
+    """Returns the cached anomaly detection model, loading it on first use."""
+    global _MODEL
+    if _MODEL is None:
+        _MODEL = joblib.load(MODEL_PATH)
+    return _MODEL
+
+def _get_scaler():
+    """Returns the cached feature scaler, loading it on first use."""
+    global _SCALER
+    if _SCALER is None:
+        _SCALER = joblib.load(SCALER_PATH)
+    return _SCALER
+
+def predict_anomalies(records):
+    """Predicts anomalies for a batch of reconciliation records in a single model call."""
     try:
-        model = joblib.load(MODEL_PATH)
-        scaler = joblib.load(SCALER_PATH)
+        model = _get_model()
+        scaler = _get_scaler()
     except FileNotFoundError:
         print("Error: Model or scaler not found. Run the training script first.")
-        return {"error": "Model not found"}, -1
+        return [{"error": "Model not found"} for _ in records]
 
     # Feature engineering must match the training script
     # We need to simulate some features if they aren't in the DB
     # In a real system, these would be calculated based on event timestamps etc.
-    features = pd.DataFrame({
-        'amount_diff': [abs(record['expected_amount'] - record['onchain_amount'])],
-        'time_to_settlement': [60], # Placeholder
-        'gas_used': [50000], # Placeholder
-        'value_date_delay': [1] # Placeholder
-    })
+    # Columns: amount_diff, time_to_settlement, gas_used, value_date_delay
+    features = np.empty((len(records), 4), dtype=np.float32)
+    features[:, 0] = [abs(r['expected_amount'] - r['onchain_amount']) for r in records]
+    features[:, 1] = 60 # Placeholder time_to_settlement
+    features[:, 2] = 50000 # Placeholder gas_used
+    features[:, 3] = 1 # Placeholder value_date_delay
 
     scaled_features = scaler.transform(features)
-    prediction = model.predict(scaled_features)
-    decision_score = model.decision_function(scaled_features)
-
-    # Prediction is -1 for anomaly, 1 for normal
-    is_anomaly = True if prediction[0] == -1 else False
-
-    result = {
-        "instruction_id": record["instruction_id"],
-        "expected_amount": record["expected_amount"],
-        "onchain_amount": record["onchain_amount"],
-        "status": record["status"],
-        "is_anomaly": is_anomaly,
-        "anomaly_score": float(decision_score[0])
-    }
-    return result
+    with parallel_backend("threading", n_jobs=-1):
+        predictions = model.predict(scaled_features)
+        decision_scores = model.decision_function(scaled_features)
+
+    return [
+        {
+            "instruction_id": record["instruction_id"],
+            "expected_amount": record["expected_amount"],
+            "onchain_amount": record["onchain_amount"],
+            "status": record["status"],
+            "is_anomaly": bool(prediction == -1),
+            "anomaly_score": float(score)
+        }
+        for record, prediction, score in zip(records, predictions, decision_scores)
+    ]
+
+def prediction_worker():
+    """Drains the prediction queue in batches and publishes the results."""
+    while True:
+        # Block until at least one record is available, then fill the batch
+        # until it is full or the timeout expires.
+        batch = [PREDICTION_QUEUE.get()]
+        deadline = time.monotonic() + PREDICTION_BATCH_TIMEOUT
+        while len(batch) < PREDICTION_BATCH_SIZE:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(PREDICTION_QUEUE.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        try:
+            prediction_results = predict_anomalies(batch)
+        except Exception as e:
+            # Keep the worker alive; a dead worker would leave the listener blocked on a full queue
+            print(f"  -> Prediction failed for a batch of {len(batch)} record(s): {e!r}")
+            continue
+
+        for prediction_result in prediction_results:
+            if "error" in prediction_result:
+                print(f"  -> Prediction failed: {prediction_result['error']}")
+                continue
+            print(f"\n--- Anomaly Detection Result for {prediction_result['instruction_id']}: "
+                  f"{'ANOMALY' if prediction_result['is_anomaly'] else 'Normal'} "
+                  f"(score {prediction_result['anomaly_score']:.4f}) ---")
+            # Add to global state for the web server
+            LAST_N_EVENTS.appendleft(prediction_result)
 
 # --- Web Server (Flask) ---
 
@@ -85,6 +151,18 @@ def run_web_server():
 
 # --- Blockchain Event Listener ---
 
+def fetch_reconciled_record(instruction_id):
+    """Fetches a record, retrying briefly until the reconciler has stored its on-chain amount."""
+    delay = RECORD_RETRY_DELAY
+    for attempt in range(RECORD_RETRY_ATTEMPTS):
+        record = get_record(instruction_id)
+        if record and record['onchain_amount']:
+            break
+        if attempt < RECORD_RETRY_ATTEMPTS - 1:
+            time.sleep(delay)
+            delay *= 2
+    return record
+
 def handle_event(event, w3):
     """Callback function to handle a new event."""
     instruction_id = event['args']['instructionId'].hex()
@@ -92,10 +170,11 @@ def handle_event(event, w3):
     print(f"\n--- Monitor received event for instruction ID: {instruction_id} ---")
 
     # Fetch the full record from the database
-    # Note: there might be a race condition if the listener is faster than the reconciler's DB update.
-    # In a real system, you'd handle this, e.g., with a small delay or a retry mechanism.
-    time.sleep(1) # Simple delay to allow DB to update
-    record = get_record(instruction_id)
+    try:
+        record = fetch_reconciled_record(instruction_id)
+    except Exception as e:
+        print(f"  -> ERROR: Could not read record for {instruction_id}: {e!r}")
+        return
 
     if not record:
         print(f"  -> ERROR: Could not find record for {instruction_id} in the database.")
@@ -105,16 +184,29 @@ def handle_event(event, w3):
         print(f"  -> INFO: Record for {instruction_id} not yet reconciled. Skipping anomaly check for now.")
         return
 
-    # Predict anomaly
-    prediction_result = predict_anomaly(dict(record))
+    # Queue the record for batched anomaly prediction
+    PREDICTION_QUEUE.put(dict(record))
+    print(f"  -> Queued {instruction_id} for anomaly detection.")
+
+
+async def listen_for_events():
+    """Subscribes to OnChainSettled logs over WebSocket and handles each pushed event."""
+    async with AsyncWeb3.persistent_websocket(WebsocketProviderV2(RPC_URL)) as w3:
+        contract_abi = get_contract_abi()
+        contract = w3.eth.contract(address=CONTRACT_ADDRESS, abi=contract_abi)
+        event_abi = next(item for item in contract_abi if item.get('type') == 'event' and item['name'] == 'OnChainSettled')
+        settled_event = contract.events.OnChainSettled()
 
-    if "error" in prediction_result:
-        print(f"  -> Prediction failed: {prediction_result['error']}")
-    else:
-        print(f"  -> Anomaly Detection Result: {'ANOMALY' if prediction_result['is_anomaly'] else 'Normal'}")
-        print(f"  -> Anomaly Score: {prediction_result['anomaly_score']:.4f}")
-        # Add to global state for the web server
-        LAST_N_EVENTS.appendleft(prediction_result)
+        await w3.eth.subscribe("logs", {
+            "address": CONTRACT_ADDRESS,
+            "topics": [event_abi_to_log_topic(event_abi)],
+        })
+        print("Listening for OnChainSettled events...")
+
+        async for response in w3.ws.process_subscriptions():
+            event = settled_event.process_log(response['result'])
+            # The DB lookup blocks, so keep it off the event loop
+            await asyncio.to_thread(handle_event, event, w3)
 
 
 def main_listener():
@@ -126,33 +218,22 @@ def main_listener():
         print("Error: WebSocket RPC_URL and SETTLEMENT_CONTRACT_ADDRESS must be set in .env")
         return
 
-    w3 = Web3(Web3.WebsocketProvider(RPC_URL))
-    if not w3.is_connected():
-        print(f"Error: Could not connect to WebSocket at {RPC_URL}")
-        return
-
-    contract_abi = json.load(open(ABI_PATH))['abi']
-    contract = w3.eth.contract(address=CONTRACT_ADDRESS, abi=contract_abi)
-    event_filter = contract.events.OnChainSettled.create_filter(fromBlock='latest')
-
-    print("Listening for OnChainSettled events...")
-    while True:
-        try:
-            for event in event_filter.get_new_entries():
-                handle_event(event, w3)
-            time.sleep(2)
-        except KeyboardInterrupt:
-            print("\nMonitor stopped.")
-            break
-        except Exception as e:
-            print(f"An error occurred in the listener loop: {e}")
-            break
+    try:
+        asyncio.run(listen_for_events())
+    except KeyboardInterrupt:
+        print("\nMonitor stopped.")
+    except Exception as e:
+        print(f"An error occurred in the listener loop: {e}")
 
 if __name__ == "__main__":
     # Start the web server in a background thread
     web_thread = Thread(target=run_web_server, daemon=True)
     web_thread.start()
 
+    # Start the batched prediction worker
+    prediction_thread = Thread(target=prediction_worker, daemon=True)
+    prediction_thread.start()
+
     # Start the main listener
     # Adding a small delay to let the web server start up
     time.sleep(2)
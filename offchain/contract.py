@@ -0,0 +1,18 @@
+import os
+import json
+from functools import lru_cache
+
+# orjson is optional and only used to speed up parsing JSON
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
+ABI_PATH = os.path.join("offchain", "build", "MT202Settlement.json")
+
+@lru_cache(maxsize=1)
+def get_contract_abi():
+    """Loads the contract ABI from the build file, parsing it only on the first call."""
+    with open(ABI_PATH, 'rb') as f:
+        return json_loads(f.read())['abi']
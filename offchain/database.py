@@ -1,17 +1,30 @@
 import sqlite3
-from datetime import datetime
+import threading
 
 DB_FILE = "reconciliation.db"
 
+# One connection per thread, reused across calls instead of reconnecting per statement
+_local = threading.local()
+
 def get_db_connection():
-    """Creates a connection to the SQLite database."""
-    conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = sqlite3.Row
+    """Returns this thread's connection to the SQLite database, opening it on first use."""
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(DB_FILE)
+        conn.row_factory = sqlite3.Row
+        # These settings are per connection; journal_mode is persisted by initialize_database.
+        # synchronous=NORMAL only fsyncs at checkpoints in WAL mode.
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        _local.conn = conn
     return conn
 
 def initialize_database():
-    """Initializes the database and creates the reconciliation_records table if it doesn't exist."""
+    """Initializes the database and creates the reconciliation_records and sync_cursors tables if they don't exist."""
     conn = get_db_connection()
+    # WAL lets readers (e.g. the monitor) run alongside the reconciliation writer. The mode is
+    # stored in the database file, so it only needs setting once, before any writer starts.
+    conn.execute("PRAGMA journal_mode=WAL")
     cursor = conn.cursor()
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS reconciliation_records (
@@ -26,65 +39,88 @@ def initialize_database():
             updated_at TIMESTAMP NOT NULL
         )
     """)
+    # Last block processed by each event listener, so it can resume after a restart
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS sync_cursors (
+            name TEXT PRIMARY KEY,
+            last_block INTEGER NOT NULL
+        )
+    """)
     conn.commit()
-    conn.close()
     print("Database initialized.")
 
+INSERT_INTENT_SQL = """
+    INSERT INTO reconciliation_records (
+        instruction_id, transaction_reference, expected_amount, currency,
+        value_date, status, created_at, updated_at
+    ) VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+"""
+
+def insert_intent_records(intents: list):
+    """Inserts records for a batch of settlement intents in a single transaction."""
+    conn = get_db_connection()
+    with conn:
+        conn.executemany(
+            INSERT_INTENT_SQL,
+            [
+                (
+                    intent_data['instruction_id'],
+                    intent_data.get('transaction_reference', ''),
+                    intent_data['amount'],
+                    intent_data['currency'],
+                    intent_data['value_date'],
+                    'PENDING_SETTLEMENT',
+                )
+                for intent_data in intents
+            ],
+        )
+
 def insert_intent_record(intent_data: dict):
     """Inserts a new record when a settlement intent is created."""
+    insert_intent_records([intent_data])
+
+# Simple reconciliation logic: exact match, using a tolerance for float comparison.
+# The comparison runs inside the UPDATE so the record is only looked up once.
+UPDATE_SETTLEMENT_SQL = """
+    UPDATE reconciliation_records
+    SET onchain_amount = ?,
+        status = CASE WHEN ABS(expected_amount - ?) < 1e-9
+                      THEN 'RECONCILED_SETTLED' ELSE 'MISMATCH_AMOUNT' END,
+        updated_at = CURRENT_TIMESTAMP
+    WHERE instruction_id = ?
+"""
+
+# Cursors only move forward, so replayed or out-of-order blocks never rewind them
+UPDATE_CURSOR_SQL = """
+    INSERT INTO sync_cursors (name, last_block) VALUES (?, ?)
+    ON CONFLICT(name) DO UPDATE SET last_block = MAX(last_block, excluded.last_block)
+"""
+
+def update_records_on_settlement(settlements: list, cursor_name: str = None, last_block: int = None):
+    """
+    Applies a batch of (instruction_id, onchain_amount) settlements in a single transaction.
+    If a cursor name and block are given, the cursor is advanced in the same transaction.
+    """
     conn = get_db_connection()
-    cursor = conn.cursor()
-    now = datetime.utcnow()
-    cursor.execute(
-        """
-        INSERT INTO reconciliation_records (
-            instruction_id, transaction_reference, expected_amount, currency,
-            value_date, status, created_at, updated_at
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        """,
-        (
-            intent_data['instruction_id'],
-            intent_data.get('transaction_reference', ''),
-            intent_data['amount'],
-            intent_data['currency'],
-            intent_data['value_date'],
-            'PENDING_SETTLEMENT',
-            now,
-            now,
-        ),
-    )
-    conn.commit()
-    conn.close()
+    with conn:
+        conn.executemany(
+            UPDATE_SETTLEMENT_SQL,
+            [(onchain_amount, onchain_amount, instruction_id) for instruction_id, onchain_amount in settlements],
+        )
+        if cursor_name is not None and last_block is not None:
+            conn.execute(UPDATE_CURSOR_SQL, (cursor_name, last_block))
 
 def update_record_on_settlement(instruction_id: str, onchain_amount: float):
     """Updates a record when an OnChainSettled event is received."""
+    update_records_on_settlement([(instruction_id, onchain_amount)])
+
+def get_last_block(cursor_name: str):
+    """Returns the last block recorded for a cursor, or None if it has never been set."""
     conn = get_db_connection()
     cursor = conn.cursor()
-    now = datetime.utcnow()
-
-    # First, get the expected amount to compare
-    cursor.execute("SELECT expected_amount FROM reconciliation_records WHERE instruction_id = ?", (instruction_id,))
+    cursor.execute("SELECT last_block FROM sync_cursors WHERE name = ?", (cursor_name,))
     record = cursor.fetchone()
-
-    if record:
-        expected_amount = record['expected_amount']
-        # Simple reconciliation logic: exact match
-        if abs(expected_amount - onchain_amount) < 1e-9: # Use tolerance for float comparison
-            new_status = 'RECONCILED_SETTLED'
-        else:
-            new_status = 'MISMATCH_AMOUNT'
-
-        cursor.execute(
-            """
-            UPDATE reconciliation_records
-            SET onchain_amount = ?, status = ?, updated_at = ?
-            WHERE instruction_id = ?
-            """,
-            (onchain_amount, new_status, now, instruction_id),
-        )
-        conn.commit()
-
-    conn.close()
+    return record['last_block'] if record else None
 
 def get_record(instruction_id: str):
     """Retrieves a single reconciliation record."""
@@ -92,7 +128,6 @@ def get_record(instruction_id: str):
     cursor = conn.cursor()
     cursor.execute("SELECT * FROM reconciliation_records WHERE instruction_id = ?", (instruction_id,))
     record = cursor.fetchone()
-    conn.close()
     return record if record else None
 
 if __name__ == '__main__':
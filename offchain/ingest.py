@@ -2,6 +2,9 @@ import re
 import json
 from datetime import datetime
 
+# Matches a ":TAG:value" line, or a ":TAG" line with no second colon and no value
+_TAG_LINE_RE = re.compile(r':([^:]*)(?::(.*))?', re.S)
+
 def parse_mt202(raw_message: str) -> dict:
     """
     Parses a raw SWIFT MT202 message text and returns a structured dictionary.
@@ -15,18 +18,11 @@ def parse_mt202(raw_message: str) -> dict:
         if not line:
             continue
 
-        if line.startswith(':'):
-            try:
-                # Format is :TAG:VALUE
-                _, tag, value = line.split(':', 2)
-                current_tag = tag
-                fields[current_tag] = value
-            except ValueError:
-                # Handle cases like :TAG: without a value on the same line
-                parts = line.split(':')
-                if len(parts) > 1:
-                    current_tag = parts[1]
-                    fields[current_tag] = "" # No value yet
+        if line[0] == ':':
+            # Format is :TAG:VALUE; a line like :TAG: without a value starts an empty field
+            match = _TAG_LINE_RE.fullmatch(line)
+            current_tag = match.group(1)
+            fields[current_tag] = match.group(2) or ''
         elif current_tag:
             # This is a continuation of the previous field
             fields[current_tag] += '\n' + line
@@ -64,6 +60,10 @@ def parse_mt202(raw_message: str) -> dict:
 
     return parsed
 
+def parse_many(raw_messages) -> list:
+    """Parses a batch of raw MT202 messages, reusing the compiled tag patterns."""
+    return [parse_mt202(raw_message) for raw_message in raw_messages]
+
 if __name__ == '__main__':
     # Example usage with a sample MT202 message
     sample_mt202 = """
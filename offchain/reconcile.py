@@ -1,9 +1,18 @@
 import os
-import json
+from functools import lru_cache, partial
+import asyncio
 import time
+import queue
+from threading import Thread
+import aiohttp
 from dotenv import load_dotenv
-from web3 import Web3
-from offchain.database import update_record_on_settlement, initialize_database
+from web3 import AsyncHTTPProvider, AsyncWeb3, WebsocketProviderV2
+from web3._utils.events import get_event_data
+from web3.exceptions import Web3Exception
+from eth_utils import event_abi_to_log_topic
+from websockets.exceptions import WebSocketException
+from offchain.contract import get_contract_abi
+from offchain.database import update_records_on_settlement, get_last_block, initialize_database
 
 # Load environment variables
 load_dotenv()
@@ -11,27 +20,212 @@ load_dotenv()
 # Configuration
 # For real-time events, a WebSocket provider is needed.
 RPC_URL = os.getenv("RPC_URL", "").replace("http", "ws")
+# Nodes without WebSocket support can be polled over HTTP instead
+HTTP_RPC_URL = os.getenv("RPC_URL")
+USE_POLLING = os.getenv("RECONCILE_POLLING", "").lower() in ("1", "true")
 CONTRACT_ADDRESS = os.getenv("SETTLEMENT_CONTRACT_ADDRESS")
-ABI_PATH = os.path.join("offchain", "build", "MT202Settlement.json")
+WEI_PER_ETHER = 10**18
+CURSOR_NAME = "reconcile" # sync_cursors entry tracking the last processed block
+LOG_CHUNK_SIZE = 2000 # blocks per eth_getLogs request when catching up
+LOG_FETCH_CONCURRENCY = 4 # concurrent eth_getLogs requests, kept below typical provider rate limits
+# Heartbeat pings detect a dead socket instead of waiting on it forever
+WEBSOCKET_KWARGS = {"ping_interval": 20, "ping_timeout": 10, "close_timeout": 1}
+RECONNECT_DELAY = 1 # seconds before the first reconnect attempt, doubled on each consecutive failure
+RECONNECT_MAX_DELAY = 30
+# Polling backs off while idle and snaps back to the minimum interval once events arrive
+POLL_MIN_INTERVAL = 0.2 # seconds
+POLL_MAX_INTERVAL = 10.0
+POLL_BACKOFF = 1.5
 
-def get_contract_abi():
-    """Loads the contract ABI from the build file."""
-    with open(ABI_PATH, 'r') as f:
-        return json.load(f)['abi']
+# Settlement writes are handed to a single writer thread so a slow SQLite commit never
+# blocks the event loop. Each queued item is a (settlements, last_block) batch.
+SETTLEMENT_QUEUE = queue.Queue(maxsize=1024)
+WRITE_BATCH_SIZE = 64 # max queued batches merged into one DB transaction
+WRITE_RETRY_DELAY = 0.5 # seconds before retrying a failed write, doubled up to WRITE_RETRY_MAX_DELAY
+WRITE_RETRY_MAX_DELAY = 30
 
-def handle_event(event, w3):
+@lru_cache(maxsize=1)
+def get_settled_event_abi():
+    """Returns the OnChainSettled event ABI and its topic0 hash, looked up only once."""
+    event_abi = next(item for item in get_contract_abi() if item.get('type') == 'event' and item['name'] == 'OnChainSettled')
+    return event_abi, event_abi_to_log_topic(event_abi)
+
+async def handle_events(events, last_block=None):
+    """
+    Normalizes a batch of OnChainSettled events and queues them for the writer thread.
+    If last_block is given, the listener's cursor is advanced to it once the batch is committed.
+    """
+    settlements = []
+    for event in events:
+        instruction_id_hex = event['args']['instructionId'].hex()
+        settled_amount_wei = event['args']['settledAmount']
+        # int / int true division is correctly rounded, without Decimal's overhead
+        settled_amount = settled_amount_wei / WEI_PER_ETHER
+
+        print(f"\n--- Event Received: OnChainSettled ---")
+        print(f"  Instruction ID: {instruction_id_hex}")
+        print(f"  Settled Amount: {settled_amount} ETH")
+        settlements.append((instruction_id_hex, settled_amount))
+
+    await enqueue_settlements(settlements, last_block)
+
+async def handle_event(event):
     """Callback function to handle a new event."""
-    instruction_id_hex = event['args']['instructionId'].hex()
-    settled_amount_wei = event['args']['settledAmount']
-    settled_amount = w3.from_wei(settled_amount_wei, 'ether')
+    await handle_events([event], last_block=event['blockNumber'])
+
+async def enqueue_settlements(settlements, last_block):
+    """
+    Queues a settlement batch for the writer thread. If the writer has fallen a full queue
+    behind, this waits in a worker thread, applying backpressure without blocking the event loop.
+    """
+    try:
+        SETTLEMENT_QUEUE.put_nowait((settlements, last_block))
+    except queue.Full:
+        await asyncio.to_thread(SETTLEMENT_QUEUE.put, (settlements, last_block))
+
+def settlement_writer():
+    """
+    Drains queued settlement batches and applies them to the database, merging up to
+    WRITE_BATCH_SIZE batches into a single transaction. Anything still queued on exit
+    is replayed from the cursor on the next run.
+    """
+    while True:
+        batches = [SETTLEMENT_QUEUE.get()]
+        while len(batches) < WRITE_BATCH_SIZE:
+            try:
+                batches.append(SETTLEMENT_QUEUE.get_nowait())
+            except queue.Empty:
+                break
+
+        settlements = [settlement for batch, _ in batches for settlement in batch]
+        blocks = [last_block for _, last_block in batches if last_block is not None]
+        # Update the database with reconciliation logic. A failed write (e.g. "database is locked"
+        # while another process holds the write lock) is retried rather than dropped, since later
+        # batches would otherwise advance the cursor past the lost settlements.
+        delay = WRITE_RETRY_DELAY
+        while True:
+            try:
+                update_records_on_settlement(settlements, CURSOR_NAME, max(blocks) if blocks else None)
+                break
+            except Exception as e:
+                print(f"Database write failed, retrying in {delay} seconds: {e!r}")
+                time.sleep(delay)
+                delay = min(delay * 2, WRITE_RETRY_MAX_DELAY)
+        if settlements:
+            print(f"  Updated database for {len(settlements)} instruction ID(s).")
+
+async def catch_up(w3, log_filter, decode_log, from_block, to_block=None):
+    """
+    Replays OnChainSettled logs from from_block to to_block (the current head by default)
+    using stateless eth_getLogs queries. Returns the number of events replayed.
+    """
+    head = await w3.eth.block_number if to_block is None else to_block
+    ranges = [(start, min(start + LOG_CHUNK_SIZE - 1, head)) for start in range(from_block, head + 1, LOG_CHUNK_SIZE)]
+    semaphore = asyncio.Semaphore(LOG_FETCH_CONCURRENCY)
 
-    print(f"\n--- Event Received: OnChainSettled ---")
-    print(f"  Instruction ID: {instruction_id_hex}")
-    print(f"  Settled Amount: {settled_amount} ETH")
+    async def fetch_logs(start, end):
+        async with semaphore:
+            return await w3.eth.get_logs({**log_filter, "fromBlock": start, "toBlock": end})
 
-    # Update the database with reconciliation logic
-    update_record_on_settlement(instruction_id_hex, float(settled_amount))
-    print(f"  Updated database for instruction ID: {instruction_id_hex}")
+    # Fetch the ranges concurrently, but apply them in block order so the cursor
+    # only ever advances past fully processed ranges
+    results = await asyncio.gather(*[fetch_logs(start, end) for start, end in ranges])
+    for (start, end), logs in zip(ranges, results):
+        await handle_events([decode_log(log) for log in logs], last_block=end)
+    return sum(len(logs) for logs in results)
+
+async def run_subscription():
+    """Subscribes to OnChainSettled logs so the node pushes each event as it is mined."""
+    async with AsyncWeb3.persistent_websocket(WebsocketProviderV2(RPC_URL, websocket_kwargs=WEBSOCKET_KWARGS)) as w3:
+        print(f"Connected to WebSocket RPC at {RPC_URL}")
+
+        # Decode logs directly against the one event ABI, skipping the contract event wrapper
+        event_abi, topic = get_settled_event_abi()
+        decode_log = partial(get_event_data, w3.codec, event_abi)
+        log_filter = {
+            "address": CONTRACT_ADDRESS,
+            "topics": [topic],
+        }
+
+        # Subscribe to the event's logs instead of polling a server-side filter.
+        # Subscribing before the catch-up means no event can fall between the two.
+        await w3.eth.subscribe("logs", log_filter)
+
+        # Replay anything missed since the last run or the last dropped connection. The last
+        # recorded block is replayed too, since it may have been only partly processed;
+        # settlement updates are idempotent.
+        last_block = get_last_block(CURSOR_NAME)
+        if last_block is not None:
+            await catch_up(w3, log_filter, decode_log, last_block)
+            print("Caught up with missed events.")
+        else:
+            # First run: start the cursor at the head so a later reconnect has a point to replay from
+            await enqueue_settlements([], await w3.eth.block_number)
+        print("Listening for OnChainSettled events...")
+
+        async for response in w3.ws.process_subscriptions():
+            await handle_event(decode_log(response['result']))
+
+async def listen_for_settlements():
+    """Runs the subscription, reconnecting with exponential backoff whenever the connection drops."""
+    delay = RECONNECT_DELAY
+    while True:
+        started = time.monotonic()
+        try:
+            await run_subscription()
+            print("Subscription stream ended.")
+        except (WebSocketException, OSError) as e:
+            print(f"WebSocket connection lost: {e}")
+        except (Web3Exception, asyncio.TimeoutError) as e:
+            # Covers ProviderConnectionError once web3's own connect retries give up,
+            # and TimeExhausted or timeouts from a stalled request during the catch-up
+            print(f"RPC request failed: {e!r}")
+
+        # A connection that stayed up for a while resets the backoff
+        if time.monotonic() - started > RECONNECT_MAX_DELAY:
+            delay = RECONNECT_DELAY
+        print(f"Reconnecting in {delay} seconds...")
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, RECONNECT_MAX_DELAY)
+
+async def poll_for_settlements():
+    """
+    Fallback for nodes without WebSocket support: polls over HTTP, querying logs only when the
+    chain head has advanced and backing off exponentially while no events arrive.
+    """
+    w3 = AsyncWeb3(AsyncHTTPProvider(HTTP_RPC_URL))
+    print(f"Polling HTTP RPC at {HTTP_RPC_URL}")
+
+    event_abi, topic = get_settled_event_abi()
+    decode_log = partial(get_event_data, w3.codec, event_abi)
+    log_filter = {
+        "address": CONTRACT_ADDRESS,
+        "topics": [topic],
+    }
+
+    # Resume from the cursor (inclusive, as in run_subscription), or from the head on a first run
+    from_block = get_last_block(CURSOR_NAME)
+    print("Listening for OnChainSettled events...")
+
+    delay = POLL_MIN_INTERVAL
+    while True:
+        try:
+            head = await w3.eth.block_number
+            if from_block is None:
+                # Seeded inside the loop so an unreachable node at startup is retried too
+                from_block = head
+                await enqueue_settlements([], from_block)
+            found = 0
+            if head >= from_block:
+                found = await catch_up(w3, log_filter, decode_log, from_block, head)
+                from_block = head + 1
+            delay = POLL_MIN_INTERVAL if found else min(delay * POLL_BACKOFF, POLL_MAX_INTERVAL)
+        except (Web3Exception, ValueError, aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
+            # HTTP errors, timeouts and rate limits: back off and retry the same range.
+            # Ranges already applied are replayed idempotently.
+            print(f"Polling failed, retrying from block {from_block}: {e!r}")
+            delay = min(delay * POLL_BACKOFF, POLL_MAX_INTERVAL)
+        await asyncio.sleep(delay)
 
 def main():
     """Main execution function to listen for events."""
@@ -44,35 +238,15 @@ def main():
 
     # Initialize DB
     initialize_database()
+    Thread(target=settlement_writer, daemon=True).start()
 
-    # Connect to Web3 via WebSocket
-    w3 = Web3(Web3.WebsocketProvider(RPC_URL))
-    if not w3.is_connected():
-        print(f"Error: Could not connect to the WebSocket RPC at {RPC_URL}.")
-        return
-
-    print(f"Connected to WebSocket RPC at {RPC_URL}")
-
-    # Load contract
-    contract_abi = get_contract_abi()
-    contract = w3.eth.contract(address=CONTRACT_ADDRESS, abi=contract_abi)
-
-    # Create event filter
-    event_filter = contract.events.OnChainSettled.create_filter(fromBlock='latest')
-    print("Listening for OnChainSettled events...")
-
-    while True:
-        try:
-            for event in event_filter.get_new_entries():
-                handle_event(event, w3)
-            time.sleep(2)
-        except KeyboardInterrupt:
-            print("\nListener stopped.")
-            break
-        except Exception as e:
-            print(f"An error occurred: {e}")
-            print("This is expected if the RPC is not running or the contract is not deployed.")
-            break
+    try:
+        asyncio.run(poll_for_settlements() if USE_POLLING else listen_for_settlements())
+    except KeyboardInterrupt:
+        print("\nListener stopped.")
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        print("This is expected if the RPC is not running or the contract is not deployed.")
 
 if __name__ == "__main__":
     main()
@@ -1,7 +1,16 @@
 import os
-import json
+import asyncio
+import time
+from dataclasses import dataclass, fields
+from datetime import datetime, timezone
+from decimal import Decimal, InvalidOperation
+from functools import lru_cache
+import aiohttp
 from dotenv import load_dotenv
-from web3 import Web3
+from eth_abi import encode as abi_encode
+from eth_utils import function_abi_to_4byte_selector
+from web3 import AsyncHTTPProvider, AsyncWeb3, Web3
+from offchain.contract import get_contract_abi, json_loads
 from offchain.database import insert_intent_record, initialize_database
 
 # Load environment variables
@@ -11,50 +20,286 @@ load_dotenv()
 RPC_URL = os.getenv("RPC_URL")
 PRIVATE_KEY = os.getenv("PRIVATE_KEY")
 CONTRACT_ADDRESS = os.getenv("SETTLEMENT_CONTRACT_ADDRESS")
-ABI_PATH = os.path.join("offchain", "build", "MT202Settlement.json")
+# A placeholder payee address, decoded once instead of being re-validated on every build
+PAYEE_ADDRESS = bytes.fromhex("70997970C51812dc3A010C7d01b50e0d17dc79C8")
+RECEIPT_POLL_LATENCY = 1 # seconds between receipt polls; block times here are about 1s
+PIPELINE_QUEUE_SIZE = 64 # bound on intents waiting between pipeline stages
+HTTP_TIMEOUT = aiohttp.ClientTimeout(total=10)
+HTTP_POOL_SIZE = 64 # max pooled keep-alive connections to the RPC node
+GAS_PRICE_TTL = 15 # seconds a fetched gas price is reused before being refreshed
+# Checksummed once at load, so web3 doesn't re-run the EIP-55 check on every transaction
+_CONTRACT = Web3.to_checksum_address(CONTRACT_ADDRESS) if CONTRACT_ADDRESS else None
 
-def get_contract_abi():
-    """Loads the contract ABI from the build file."""
-    with open(ABI_PATH, 'r') as f:
-        return json.load(f)['abi']
+@lru_cache(maxsize=1024)
+def value_date_to_timestamp(value_date):
+    """Converts a YYYY-MM-DD value date to a UTC Unix timestamp, cached since intents often share a date."""
+    return int(datetime.strptime(value_date, "%Y-%m-%d").replace(tzinfo=timezone.utc).timestamp())
 
-def submit_intent(w3, contract, intent_data, account):
-    """Submits a settlement intent to the smart contract."""
+@dataclass(frozen=True)
+class SettlementIntent:
+    """A settlement intent from a parsed MT202 message, validated and coerced once on load."""
+    transaction_reference: str
+    amount: Decimal
+    currency: str
+    value_date: str
+    ordering_institution: str
+    beneficiary_institution: str
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "SettlementIntent":
+        """Builds an intent from a parsed MT202 dict, raising ValueError if a field is missing or invalid."""
+        missing = [field.name for field in fields(cls) if field.name not in data]
+        if missing:
+            raise ValueError(f"Intent is missing fields: {', '.join(missing)}")
+
+        # MT202 references (field :20:) are at most 16 ASCII characters, so plain encoding suffices
+        reference = str(data['transaction_reference'])
+        if not reference.isascii() or len(reference) > 32:
+            raise ValueError(f"Transaction reference is not ASCII of at most 32 bytes: {reference}")
+        try:
+            # Going through str keeps the decimal digits of float amounts exact
+            amount = Decimal(str(data['amount']))
+        except InvalidOperation:
+            raise ValueError(f"Invalid amount: {data['amount']}")
+        # NaN, infinities and non-positive amounts parse fine but can never be converted to wei
+        if not amount.is_finite() or amount <= 0:
+            raise ValueError(f"Amount must be a finite positive number: {data['amount']}")
+        value_date = str(data['value_date'])
+        # Raises ValueError for anything but YYYY-MM-DD, and warms the cache for send_intent
+        value_date_to_timestamp(value_date)
+
+        return cls(
+            transaction_reference=reference,
+            amount=amount,
+            currency=str(data['currency']),
+            value_date=value_date,
+            ordering_institution=str(data['ordering_institution']),
+            beneficiary_institution=str(data['beneficiary_institution']),
+        )
+
+    def to_record(self) -> dict:
+        """Returns the fields stored by insert_intent_record."""
+        return {
+            'instruction_id': self.transaction_reference,
+            'transaction_reference': self.transaction_reference,
+            'amount': float(self.amount),
+            'currency': self.currency,
+            'value_date': self.value_date,
+        }
+
+# Shared HTTP session, so web3 and the batch requests reuse keep-alive connections
+_SESSION = None
+
+@lru_cache(maxsize=1)
+def get_create_intent_encoding():
+    """Returns the selector and argument types of createSettlementIntent, derived once from the ABI."""
+    fn_abi = next(
+        item for item in get_contract_abi()
+        if item.get('type') == 'function' and item['name'] == 'createSettlementIntent'
+    )
+    return function_abi_to_4byte_selector(fn_abi), [arg['type'] for arg in fn_abi['inputs']]
+
+@lru_cache(maxsize=None)
+def address_to_bytes(address):
+    """Decodes a hex address to its 20 raw bytes once, so eth_abi encodes it without re-validating."""
+    return bytes.fromhex(address[2:])
+
+def get_http_session():
+    """Returns the shared aiohttp session, creating it on first use inside the running event loop."""
+    global _SESSION
+    if _SESSION is None or _SESSION.closed:
+        _SESSION = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=HTTP_POOL_SIZE),
+            timeout=HTTP_TIMEOUT,
+        )
+    return _SESSION
+
+async def fetch_nonce_and_gas_price(address):
+    """Fetches the account nonce and current gas price in a single JSON-RPC batch request."""
+    # web3's HTTP providers send one POST per call, so the batch is posted directly
+    async with get_http_session().post(RPC_URL, json=[
+        {"jsonrpc": "2.0", "id": 0, "method": "eth_getTransactionCount", "params": [address, "pending"]},
+        {"jsonrpc": "2.0", "id": 1, "method": "eth_gasPrice", "params": []},
+    ]) as response:
+        response.raise_for_status()
+        payload = await response.json(loads=json_loads)
+
+    # Batch responses may come back in any order
+    results = {item['id']: item for item in payload}
+    for item in results.values():
+        if 'error' in item:
+            raise ValueError(f"RPC error: {item['error']}")
+    return int(results[0]['result'], 16), int(results[1]['result'], 16)
+
+class NonceTracker:
+    """
+    Hands out nonces for one signer locally, so back-to-back submissions don't each fetch the
+    transaction count. The nonce is only fetched on first use and after a failed send; the
+    gas price is refreshed once it is older than GAS_PRICE_TTL.
+    """
+
+    def __init__(self, address):
+        self.address = address
+        self._nonce = None
+        self._gas_price = None
+        self._gas_price_time = 0.0
+        self._lock = asyncio.Lock()
+
+    async def reserve(self):
+        """Returns the next (nonce, gas_price), syncing with the node first if needed."""
+        async with self._lock:
+            if self._nonce is None:
+                # The gas price comes back in the same batch as the nonce
+                self._nonce, self._gas_price = await fetch_nonce_and_gas_price(self.address)
+                self._gas_price_time = time.monotonic()
+            elif time.monotonic() - self._gas_price_time > GAS_PRICE_TTL:
+                self._gas_price = await fetch_gas_price()
+                self._gas_price_time = time.monotonic()
+            nonce = self._nonce
+            self._nonce += 1
+            return nonce, self._gas_price
+
+    def resync(self):
+        """Discards the local nonce so the next reservation refetches it from the node."""
+        self._nonce = None
+
+@lru_cache(maxsize=None)
+def get_nonce_tracker(address):
+    """Returns the process-wide NonceTracker for an account."""
+    return NonceTracker(address)
+
+async def fetch_gas_price():
+    """Fetches the current gas price with a single JSON-RPC request on the shared session."""
+    async with get_http_session().post(RPC_URL, json={
+        "jsonrpc": "2.0", "id": 0, "method": "eth_gasPrice", "params": [],
+    }) as response:
+        response.raise_for_status()
+        payload = await response.json(loads=json_loads)
+
+    if 'error' in payload:
+        raise ValueError(f"RPC error: {payload['error']}")
+    return int(payload['result'], 16)
+
+async def send_intent(w3, intent, account, nonce=None, gas_price=None):
+    """
+    Builds, signs and sends a settlement intent transaction, returning its hash.
+    The nonce and gas price come from the account's NonceTracker unless they are provided.
+    """
     print("Submitting settlement intent...")
 
-    # Convert data to contract-friendly format
-    instruction_id_bytes = Web3.to_bytes(text=intent_data['transaction_reference']).ljust(32, b'\0')
-    amount_in_wei = w3.to_wei(intent_data['amount'], 'ether') # Assuming amount is in ether-like units
+    # Convert data to contract-friendly format; SettlementIntent has already validated it
+    instruction_id_bytes = intent.transaction_reference.encode('ascii').ljust(32, b'\0')
+    amount_in_wei = w3.to_wei(intent.amount, 'ether') # Assuming amount is in ether-like units
 
     # Build transaction
-    nonce = w3.eth.get_transaction_count(account.address)
-    tx = contract.functions.createSettlementIntent(
-        instruction_id_bytes,
-        account.address,  # Payer is the submitting account for this prototype
-        "0x70997970C51812dc3A010C7d01b50e0d17dc79C8", # A placeholder payee address
-        amount_in_wei,
-        intent_data['currency'],
-        int(Web3.to_timestamp(intent_data['value_date'])),
-        intent_data['ordering_institution'],
-        intent_data['beneficiary_institution']
-    ).build_transaction({
+    tracker = get_nonce_tracker(account.address)
+    if nonce is None:
+        nonce, tracked_gas_price = await tracker.reserve()
+        gas_price = tracked_gas_price if gas_price is None else gas_price
+    elif gas_price is None:
+        gas_price = await w3.eth.gas_price
+    # Encode the call with the cached selector and build the transaction locally,
+    # rather than having web3 re-resolve the function ABI for every intent
+    selector, arg_types = get_create_intent_encoding()
+    tx = {
+        'to': _CONTRACT,
+        'value': 0,
+        'data': selector + abi_encode(arg_types, [
+            instruction_id_bytes,
+            address_to_bytes(account.address),  # Payer is the submitting account for this prototype
+            PAYEE_ADDRESS,
+            amount_in_wei,
+            intent.currency,
+            value_date_to_timestamp(intent.value_date),
+            intent.ordering_institution,
+            intent.beneficiary_institution
+        ]),
         'chainId': 1337, # Hardhat default
         'gas': 2000000,
-        'gasPrice': w3.eth.gas_price,
+        'gasPrice': gas_price,
         'nonce': nonce,
-    })
+    }
 
     # Sign and send transaction
     signed_tx = w3.eth.account.sign_transaction(tx, private_key=PRIVATE_KEY)
-    tx_hash = w3.eth.send_raw_transaction(signed_tx.rawTransaction)
+    try:
+        tx_hash = await w3.eth.send_raw_transaction(signed_tx.rawTransaction)
+    except Exception:
+        # Whether the node rejected it (nonce too low/high, underpriced) or the request failed,
+        # this nonce may never be used; refetch the count so later transactions don't queue
+        # behind a gap
+        tracker.resync()
+        raise
     print(f"Transaction sent with hash: {tx_hash.hex()}")
 
-    # Wait for confirmation
-    receipt = w3.eth.wait_for_transaction_receipt(tx_hash)
+    return tx_hash
+
+async def submit_intent(w3, intent, account, nonce=None, gas_price=None):
+    """
+    Submits a settlement intent to the smart contract and waits for its receipt.
+    The nonce and gas price come from the account's NonceTracker unless they are provided.
+    """
+    tx_hash = await send_intent(w3, intent, account, nonce=nonce, gas_price=gas_price)
+
+    # Wait for confirmation without blocking other submissions on the event loop
+    receipt = await w3.eth.wait_for_transaction_receipt(tx_hash, poll_latency=RECEIPT_POLL_LATENCY)
     print("Transaction confirmed.")
     return receipt
 
-def main():
+async def submit_many(w3, intents, account):
+    """
+    Submits several settlement intents and returns their receipts in order.
+    Transactions are sent one at a time so they reach the node in nonce order;
+    only the receipt waits run concurrently.
+    """
+    tx_hashes = []
+    for intent in intents:
+        tx_hashes.append(await send_intent(w3, intent, account))
+    return await asyncio.gather(*[
+        w3.eth.wait_for_transaction_receipt(tx_hash, poll_latency=RECEIPT_POLL_LATENCY)
+        for tx_hash in tx_hashes
+    ])
+
+async def submit_pipeline(w3, intents, account):
+    """
+    Stores, sends and confirms settlement intents in three concurrent stages linked by bounded
+    queues, so the DB write, send and receipt wait of different intents overlap.
+    Returns the receipts in submission order.
+    """
+    send_queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    receipt_queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    receipts = []
+
+    async def store():
+        for intent in intents:
+            # The SQLite commit runs in a worker thread so it doesn't stall the other stages
+            await asyncio.to_thread(insert_intent_record, intent.to_record())
+            print(f"Stored pending record in DB for instruction ID: {intent.transaction_reference}")
+            await send_queue.put(intent)
+        await send_queue.put(None)
+
+    async def send():
+        # Nonces come from the local NonceTracker, so sends don't wait on earlier receipts
+        while (intent := await send_queue.get()) is not None:
+            tx_hash = await send_intent(w3, intent, account)
+            await receipt_queue.put(tx_hash)
+        await receipt_queue.put(None)
+
+    async def confirm():
+        while (tx_hash := await receipt_queue.get()) is not None:
+            receipts.append(await w3.eth.wait_for_transaction_receipt(tx_hash, poll_latency=RECEIPT_POLL_LATENCY))
+            print(f"Transaction confirmed: {tx_hash.hex()}")
+
+    tasks = [asyncio.create_task(stage()) for stage in (store, send, confirm)]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        # If one stage fails, stop the others rather than leaving them blocked on a queue
+        for task in tasks:
+            task.cancel()
+    return receipts
+
+async def main():
     """Main execution function."""
     # Since we can't deploy, we can't run this.
     # This script is for demonstration of how it would work.
@@ -65,10 +310,20 @@ def main():
         print("Error: RPC_URL, PRIVATE_KEY, and SETTLEMENT_CONTRACT_ADDRESS must be set in .env")
         return
 
-    # Connect to Web3
-    w3 = Web3(Web3.HTTPProvider(RPC_URL))
+    # Connect to Web3, sharing the pooled session with the batch requests
+    session = get_http_session()
+    provider = AsyncHTTPProvider(RPC_URL, request_kwargs={"timeout": HTTP_TIMEOUT})
+    await provider.cache_async_session(session)
+    w3 = AsyncWeb3(provider)
 
-    if not w3.is_connected():
+    try:
+        await submit_sample_intent(w3)
+    finally:
+        await session.close()
+
+async def submit_sample_intent(w3):
+    """Stores the sample intent and submits it over an established connection."""
+    if not await w3.is_connected():
         print("Error: Could not connect to the Ethereum node.")
         return
 
@@ -79,26 +334,16 @@ def main():
     w3.eth.default_account = account.address
     print(f"Using account: {account.address}")
 
-    # Load contract
-    contract_abi = get_contract_abi()
-    contract = w3.eth.contract(address=CONTRACT_ADDRESS, abi=contract_abi)
-
     # Load sample data
-    with open('sample_data/sample_mt202.json', 'r') as f:
-        intent_data = json.load(f)
+    with open('sample_data/sample_mt202.json', 'rb') as f:
+        intent = SettlementIntent.from_dict(json_loads(f.read()))
 
-    # Initialize DB and store intent
+    # Initialize DB
     initialize_database()
-    db_intent_data = {
-        'instruction_id': intent_data['transaction_reference'],
-        **intent_data
-    }
-    insert_intent_record(db_intent_data)
-    print(f"Stored pending record in DB for instruction ID: {intent_data['transaction_reference']}")
 
-    # Submit to contract
+    # Store the intent and submit it to the contract
     try:
-        submit_intent(w3, contract, intent_data, account)
+        await submit_pipeline(w3, [intent], account)
         print("Submission process complete.")
     except Exception as e:
         print(f"\nAn error occurred during submission: {e}")
@@ -106,4 +351,4 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
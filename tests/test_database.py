@@ -0,0 +1,103 @@
+import sqlite3
+import threading
+
+import pytest
+
+from offchain import database
+
+
+@pytest.fixture(autouse=True)
+def fresh_db(tmp_path, monkeypatch):
+    """Points the database module at an empty file with no cached connections."""
+    monkeypatch.setattr(database, "DB_FILE", str(tmp_path / "reconciliation.db"))
+    monkeypatch.setattr(database, "_local", threading.local())
+    database.initialize_database()
+    yield
+    database.get_db_connection().close()
+
+
+def make_intent(instruction_id, amount):
+    return {
+        "instruction_id": instruction_id,
+        "transaction_reference": f"ref-{instruction_id}",
+        "amount": amount,
+        "currency": "USD",
+        "value_date": "2024-08-15",
+    }
+
+
+def test_initialize_database_enables_wal():
+    journal_mode = database.get_db_connection().execute("PRAGMA journal_mode").fetchone()[0]
+    assert journal_mode == "wal"
+
+
+def test_insert_intent_records_stores_pending_rows():
+    database.insert_intent_records([make_intent("id-1", 100.5), make_intent("id-2", 200.0)])
+
+    record = database.get_record("id-1")
+    assert record["transaction_reference"] == "ref-id-1"
+    assert record["expected_amount"] == 100.5
+    assert record["onchain_amount"] is None
+    assert record["status"] == "PENDING_SETTLEMENT"
+    assert record["created_at"] is not None
+    assert database.get_record("id-2")["expected_amount"] == 200.0
+
+
+def test_insert_intent_records_is_atomic():
+    with pytest.raises(sqlite3.IntegrityError):
+        database.insert_intent_records([make_intent("id-1", 1.0), make_intent("id-1", 2.0)])
+    assert database.get_record("id-1") is None
+
+
+def test_update_records_on_settlement_reconciles_and_flags_mismatches():
+    database.insert_intent_records([make_intent("id-1", 100.5), make_intent("id-2", 200.0)])
+
+    database.update_records_on_settlement([("id-1", 100.5), ("id-2", 199.99)])
+
+    settled = database.get_record("id-1")
+    assert settled["onchain_amount"] == 100.5
+    assert settled["status"] == "RECONCILED_SETTLED"
+    mismatched = database.get_record("id-2")
+    assert mismatched["onchain_amount"] == 199.99
+    assert mismatched["status"] == "MISMATCH_AMOUNT"
+
+
+def test_update_record_on_settlement_wraps_the_batch_update():
+    database.insert_intent_record(make_intent("id-1", 10.0))
+    database.update_record_on_settlement("id-1", 10.0)
+    assert database.get_record("id-1")["status"] == "RECONCILED_SETTLED"
+
+
+def test_cursor_is_unset_until_first_update():
+    assert database.get_last_block("reconcile") is None
+    database.update_records_on_settlement([], "reconcile", 42)
+    assert database.get_last_block("reconcile") == 42
+
+
+def test_cursor_only_moves_forward():
+    database.update_records_on_settlement([], "reconcile", 100)
+    database.update_records_on_settlement([], "reconcile", 90)
+    assert database.get_last_block("reconcile") == 100
+
+    database.update_records_on_settlement([], "reconcile", 101)
+    assert database.get_last_block("reconcile") == 101
+
+
+def test_cursors_are_tracked_per_name():
+    database.update_records_on_settlement([], "reconcile", 5)
+    database.update_records_on_settlement([], "monitor", 7)
+    assert database.get_last_block("reconcile") == 5
+    assert database.get_last_block("monitor") == 7
+
+
+def test_cursor_is_not_touched_without_a_block():
+    database.update_records_on_settlement([], "reconcile", 5)
+    database.update_records_on_settlement([], "reconcile", None)
+    assert database.get_last_block("reconcile") == 5
+
+
+def test_cursor_and_settlements_commit_together():
+    database.insert_intent_record(make_intent("id-1", 10.0))
+    database.update_records_on_settlement([("id-1", 10.0)], "reconcile", 12)
+    assert database.get_record("id-1")["status"] == "RECONCILED_SETTLED"
+    assert database.get_last_block("reconcile") == 12
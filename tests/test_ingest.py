@@ -0,0 +1,81 @@
+from offchain.ingest import parse_mt202, parse_many
+
+SAMPLE_MT202 = """
+:20:TXREF12345
+:21:RELREF67890
+:32A:240815USD12345.67
+:50K:/12345678
+ORDERING BANK NAME
+CITY
+:52A:ORDERINGAGENTBIC
+:57A:BENEFICIARYBANKBIC
+:59:/987654321
+BENEFICIARY NAME
+ADDRESS LINE 1
+:71A:OUR
+:72:/SND2REC/INFO
+SOME MORE INFO
+"""
+
+EXPECTED_SAMPLE = {
+    "transaction_reference": "TXREF12345",
+    "related_reference": "RELREF67890",
+    "value_date": "2024-08-15",
+    "currency": "USD",
+    "amount": 12345.67,
+    "ordering_institution": "/12345678 ORDERING BANK NAME CITY",
+    "ordering_agent": "ORDERINGAGENTBIC",
+    "account_with_institution": "BENEFICIARYBANKBIC",
+    "beneficiary": "/987654321 BENEFICIARY NAME ADDRESS LINE 1",
+    "charges": "OUR",
+    "sender_to_receiver_info": "/SND2REC/INFO SOME MORE INFO",
+}
+
+
+def test_parses_readme_sample():
+    assert parse_mt202(SAMPLE_MT202) == EXPECTED_SAMPLE
+
+
+def test_crlf_line_endings_parse_like_lf():
+    assert parse_mt202(SAMPLE_MT202.replace("\n", "\r\n")) == EXPECTED_SAMPLE
+
+
+def test_comma_decimal_amount():
+    parsed = parse_mt202(":20:ANOTHERREF\n:32A:250101EUR999,00\n:57A:SOMEOTHERBIC")
+    assert parsed == {
+        "transaction_reference": "ANOTHERREF",
+        "value_date": "2025-01-01",
+        "currency": "EUR",
+        "amount": 999.0,
+        "account_with_institution": "SOMEOTHERBIC",
+    }
+
+
+def test_value_after_tag_is_not_stripped():
+    assert parse_mt202(":20: X")["transaction_reference"] == " X"
+
+
+def test_colon_line_without_closing_colon_starts_a_new_tag():
+    parsed = parse_mt202(":20:foo\n:ABC\nbar")
+    assert parsed == {"transaction_reference": "foo"}
+
+    parsed = parse_mt202(":20:REF\n:72:/X/\n:Y")
+    assert parsed["sender_to_receiver_info"] == "/X/"
+
+
+def test_empty_tag_value_continues_on_next_lines():
+    parsed = parse_mt202(":20:REF\n:59:\n/987654321\nBENEFICIARY NAME")
+    assert parsed["beneficiary"] == "/987654321 BENEFICIARY NAME"
+
+
+def test_lines_before_the_first_tag_are_ignored():
+    assert parse_mt202("preamble\n:20:REF") == {"transaction_reference": "REF"}
+
+
+def test_value_may_contain_colons():
+    assert parse_mt202(":72:/SND2REC/a:b:c")["sender_to_receiver_info"] == "/SND2REC/a:b:c"
+
+
+def test_parse_many_matches_parse_mt202():
+    messages = [SAMPLE_MT202, ":20:REF"]
+    assert parse_many(messages) == [parse_mt202(message) for message in messages]
@@ -0,0 +1,94 @@
+import asyncio
+
+import pytest
+
+from offchain import submit
+
+
+class StubRPC:
+    """Stands in for the node: counts nonce/gas-price fetches and serves settable values."""
+
+    def __init__(self, nonce=7, gas_price=100):
+        self.nonce = nonce
+        self.gas_price = gas_price
+        self.nonce_fetches = 0
+        self.gas_price_fetches = 0
+
+    async def fetch_nonce_and_gas_price(self, address):
+        self.nonce_fetches += 1
+        await asyncio.sleep(0)
+        return self.nonce, self.gas_price
+
+    async def fetch_gas_price(self):
+        self.gas_price_fetches += 1
+        return self.gas_price
+
+
+@pytest.fixture
+def rpc(monkeypatch):
+    stub = StubRPC()
+    monkeypatch.setattr(submit, "fetch_nonce_and_gas_price", stub.fetch_nonce_and_gas_price)
+    monkeypatch.setattr(submit, "fetch_gas_price", stub.fetch_gas_price)
+    return stub
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(submit.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_reserve_syncs_once_then_counts_locally(rpc, clock):
+    async def run():
+        tracker = submit.NonceTracker("0xabc")
+        return [await tracker.reserve() for _ in range(3)]
+
+    assert asyncio.run(run()) == [(7, 100), (8, 100), (9, 100)]
+    assert rpc.nonce_fetches == 1
+
+
+def test_concurrent_reservations_get_distinct_ordered_nonces(rpc, clock):
+    async def run():
+        tracker = submit.NonceTracker("0xabc")
+        return await asyncio.gather(*[tracker.reserve() for _ in range(5)])
+
+    assert [nonce for nonce, _ in asyncio.run(run())] == [7, 8, 9, 10, 11]
+    assert rpc.nonce_fetches == 1
+
+
+def test_resync_refetches_the_nonce(rpc, clock):
+    async def run():
+        tracker = submit.NonceTracker("0xabc")
+        await tracker.reserve()
+        await tracker.reserve()
+        rpc.nonce = 8  # The node only saw the first transaction
+        tracker.resync()
+        return await tracker.reserve()
+
+    assert asyncio.run(run()) == (8, 100)
+    assert rpc.nonce_fetches == 2
+
+
+def test_gas_price_is_refreshed_after_ttl(rpc, clock):
+    async def run():
+        tracker = submit.NonceTracker("0xabc")
+        first = await tracker.reserve()
+
+        rpc.gas_price = 150
+        clock[0] += submit.GAS_PRICE_TTL / 2
+        within_ttl = await tracker.reserve()
+
+        clock[0] += submit.GAS_PRICE_TTL
+        after_ttl = await tracker.reserve()
+        return first, within_ttl, after_ttl
+
+    assert asyncio.run(run()) == ((7, 100), (8, 100), (9, 150))
+    assert rpc.gas_price_fetches == 1
+    # Refreshing the gas price must not disturb the locally tracked nonce
+    assert rpc.nonce_fetches == 1
+
+
+def test_get_nonce_tracker_is_shared_per_address():
+    assert submit.get_nonce_tracker("0xabc") is submit.get_nonce_tracker("0xabc")
+    assert submit.get_nonce_tracker("0xabc") is not submit.get_nonce_tracker("0xdef")